@@ -0,0 +1,84 @@
+"""WebSocket connection manager for broadcasting device updates to web clients."""
+
+import asyncio
+from typing import Callable
+import orjson
+from fastapi import WebSocket
+
+
+class ConnectionManager:
+    """Manages WebSocket connections for broadcasting device updates."""
+
+    # Messages buffered per client before it is evicted as a slow consumer
+    SEND_QUEUE_SIZE = 32
+
+    def __init__(self):
+        self.active_connections: set[WebSocket] = set()
+        self._send_queues: dict[WebSocket, asyncio.Queue] = {}
+        self._writers: dict[WebSocket, asyncio.Task] = {}
+        # Close handshakes for evicted clients, kept referenced until done
+        self._closing: set[asyncio.Task] = set()
+
+    async def connect(self, websocket: WebSocket, initial_message: Callable[[], dict] | None = None):
+        """Accept a client and start its writer.
+
+        initial_message is built right as the client is registered and queued
+        ahead of any broadcast, so the client never sees an update before it.
+        """
+        await websocket.accept()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.SEND_QUEUE_SIZE)
+        if initial_message:
+            queue.put_nowait(orjson.dumps(initial_message()).decode())
+        self.active_connections.add(websocket)
+        self._send_queues[websocket] = queue
+        self._writers[websocket] = asyncio.create_task(self._writer(websocket, queue))
+
+    def has_clients(self) -> bool:
+        """Whether any WebSocket client is connected."""
+        return bool(self.active_connections)
+
+    def disconnect(self, websocket: WebSocket):
+        self.active_connections.discard(websocket)
+        self._send_queues.pop(websocket, None)
+        writer = self._writers.pop(websocket, None)
+        if writer and writer is not asyncio.current_task():
+            writer.cancel()
+
+    async def _writer(self, websocket: WebSocket, queue: asyncio.Queue):
+        """Drain one client's queue so a slow socket never stalls broadcasts."""
+        try:
+            while True:
+                data = await queue.get()
+                await websocket.send_text(data)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            self.disconnect(websocket)
+
+    async def broadcast(self, message: dict):
+        """Send message to all connected clients."""
+        # Encode once and hand the same string to every client's writer
+        data = orjson.dumps(message).decode()
+        slow = []
+        for connection in self.active_connections:
+            try:
+                self._send_queues[connection].put_nowait(data)
+            except asyncio.QueueFull:
+                slow.append(connection)
+        # Evict clients that have fallen too far behind. Closing waits on the
+        # client, so run it in the background rather than stall the caller.
+        for conn in slow:
+            self.disconnect(conn)
+            task = asyncio.create_task(self._close(conn))
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+
+    async def _close(self, websocket: WebSocket):
+        try:
+            await websocket.close(code=1013)
+        except Exception:
+            pass
+
+
+# Global WebSocket manager instance
+ws_manager = ConnectionManager()
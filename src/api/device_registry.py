@@ -1,16 +1,40 @@
 """In-memory device registry for tracking ESP32 devices."""
 
-from datetime import datetime
-from typing import Any
+import time
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timezone
+from typing import Any, Callable, Iterator
 
 
 class DeviceRegistry:
     """Tracks connected ESP32 devices and their state."""
 
+    # Deleted-device tombstones expire after this long, and at most this many are kept
+    DELETED_TTL_SECONDS = 3600
+    MAX_DELETED = 10_000
+
     def __init__(self):
         self._devices: dict[str, dict[str, Any]] = {}
         # Track recently deleted devices to prevent MQTT re-registration
-        self._deleted_devices: set[str] = set()
+        # (device_id -> monotonic deletion time, oldest first)
+        self._deleted_devices: OrderedDict[str, float] = OrderedDict()
+        # last_seen only needs second resolution, so reuse the formatted
+        # string until the wall-clock second advances
+        self._cached_ts_second: int = 0
+        self._cached_ts_str: str = ""
+        # Secondary indices so filtered listings don't scan every device
+        self._by_type: dict[str, set[str]] = defaultdict(set)
+        self._online: set[str] = set()
+        # Callbacks run with the device_id whenever a device is removed
+        self._remove_listeners: list[Callable[[str], None]] = []
+
+    def _now_iso(self) -> str:
+        """Current UTC time as an ISO string, cached per second."""
+        sec = time.time_ns() // 1_000_000_000
+        if sec != self._cached_ts_second:
+            self._cached_ts_second = sec
+            self._cached_ts_str = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(sec))
+        return self._cached_ts_str
 
     def register_device(self, device_id: str, info: dict | None = None) -> bool:
         """Register a new device or update existing.
@@ -18,10 +42,10 @@ class DeviceRegistry:
         Returns False if device was recently deleted (won't be registered).
         """
         # Skip recently deleted devices - prevents stale MQTT messages from re-registering
-        if device_id in self._deleted_devices:
+        if self.is_deleted(device_id):
             return False
 
-        now = datetime.utcnow().isoformat()
+        now = self._now_iso()
 
         if device_id not in self._devices:
             self._devices[device_id] = {
@@ -29,43 +53,75 @@ class DeviceRegistry:
                 "type": None,
                 "values": {},
                 "online": True,
-                "first_seen": now,
+                "first_seen": datetime.now(timezone.utc).replace(tzinfo=None).isoformat(),
                 "last_seen": now,
             }
         else:
             self._devices[device_id]["last_seen"] = now
             self._devices[device_id]["online"] = True
 
+        self._online.add(device_id)
+
         if info:
+            old_type = self._devices[device_id]["type"]
             self._devices[device_id].update(info)
+            self._reindex(device_id, old_type)
 
         return True
 
-    def update_device(self, device_id: str, updates: dict) -> bool:
+    def _reindex(self, device_id: str, old_type: str | None):
+        """Bring the type/online indices in line with the stored device."""
+        device = self._devices[device_id]
+        new_type = device.get("type")
+        if new_type != old_type:
+            if old_type is not None:
+                self._discard_type(device_id, old_type)
+            if new_type is not None:
+                self._by_type[new_type].add(device_id)
+        if device.get("online"):
+            self._online.add(device_id)
+        else:
+            self._online.discard(device_id)
+
+    def _discard_type(self, device_id: str, device_type: str):
+        bucket = self._by_type.get(device_type)
+        if bucket is not None:
+            bucket.discard(device_id)
+            if not bucket:
+                del self._by_type[device_type]
+
+    def update_device(self, device_id: str, updates: dict) -> dict | None:
         """Update device state.
 
-        Returns False if device was recently deleted (won't be updated).
+        Returns the updated device, or None if device was recently deleted (won't be updated).
         """
-        if device_id not in self._devices:
+        dev = self._devices.get(device_id)
+        if dev is None:
             if not self.register_device(device_id):
-                return False  # Device was deleted, don't update
+                return None  # Device was deleted, don't update
+            dev = self._devices[device_id]
 
+        old_type = dev.get("type")
         for key, value in updates.items():
             if key == "values" and isinstance(value, dict):
                 # Merge values - ensure values dict exists
-                if not self._devices[device_id].get("values"):
-                    self._devices[device_id]["values"] = {}
-                self._devices[device_id]["values"].update(value)
+                current = dev.get("values")
+                if not current:
+                    current = dev["values"] = {}
+                current.update(value)
             else:
-                self._devices[device_id][key] = value
+                dev[key] = value
 
-        self._devices[device_id]["last_seen"] = datetime.utcnow().isoformat()
-        return True
+        dev["last_seen"] = self._now_iso()
+        if "type" in updates or "online" in updates:
+            self._reindex(device_id, old_type)
+        return dev
 
     def mark_offline(self, device_id: str):
         """Mark a device as offline."""
         if device_id in self._devices:
             self._devices[device_id]["online"] = False
+            self._online.discard(device_id)
 
     def get_device(self, device_id: str) -> dict | None:
         """Get a device by ID."""
@@ -75,19 +131,46 @@ class DeviceRegistry:
         """Get all devices."""
         return list(self._devices.values())
 
+    def get_devices_by_type(self, device_type: str) -> Iterator[dict]:
+        """Iterate devices configured as the given type."""
+        return (self._devices[i] for i in self._by_type.get(device_type, ()))
+
+    def get_online_devices(self) -> Iterator[dict]:
+        """Iterate devices currently marked online."""
+        return (self._devices[i] for i in self._online)
+
     def remove_device(self, device_id: str):
         """Remove a device from the registry and mark as deleted."""
-        self._devices.pop(device_id, None)
+        device = self._devices.pop(device_id, None)
+        if device is not None and device.get("type") is not None:
+            self._discard_type(device_id, device["type"])
+        self._online.discard(device_id)
         # Track as deleted to prevent MQTT re-registration
-        self._deleted_devices.add(device_id)
+        self._deleted_devices[device_id] = time.monotonic()
+        self._deleted_devices.move_to_end(device_id)
+        while len(self._deleted_devices) > self.MAX_DELETED:
+            self._deleted_devices.popitem(last=False)
+        for listener in self._remove_listeners:
+            listener(device_id)
+
+    def add_remove_listener(self, listener: Callable[[str], None]):
+        """Register a callback to run when a device is removed."""
+        self._remove_listeners.append(listener)
 
     def is_deleted(self, device_id: str) -> bool:
         """Check if a device was recently deleted."""
-        return device_id in self._deleted_devices
+        deleted_at = self._deleted_devices.get(device_id)
+        if deleted_at is None:
+            return False
+        if time.monotonic() - deleted_at < self.DELETED_TTL_SECONDS:
+            return True
+        # Tombstone expired - let the device register again
+        del self._deleted_devices[device_id]
+        return False
 
     def clear_deleted(self, device_id: str):
         """Allow a deleted device to be re-registered (for manual re-add)."""
-        self._deleted_devices.discard(device_id)
+        self._deleted_devices.pop(device_id, None)
 
     def clear_all_deleted(self):
         """Clear all deleted device tracking (e.g., on server restart)."""
@@ -2,155 +2,228 @@
 
 import asyncio
 import math
-import random
-from dataclasses import dataclass, field
 
+import numpy as np
 
-@dataclass
-class HRDeviceState:
-    """State for a single device's HR variation."""
-    target: int = 70
-    float_hr: float = 70.0
-    phase: float = field(default_factory=lambda: random.random() * math.pi * 2)
-    enabled: bool = False
-    task: asyncio.Task | None = field(default=None, repr=False)
+
+# One cycle of the ±2 BPM sine variation, indexed by integer phase.
+# Stepping 8 slots per tick matches the old 0.2 rad/tick advance.
+_SIN_LUT_SIZE = 256
+_SIN_LUT = (np.sin(np.arange(_SIN_LUT_SIZE) * (2 * math.pi / _SIN_LUT_SIZE)) * 2).astype(np.float32)
+_PHASE_STEP = 8
+
+# Initial slot capacity; arrays double when full
+_INITIAL_CAPACITY = 16
+
+# Marks a slot that hasn't transmitted since variation was (re)enabled
+_NOT_SENT = -1
 
 
 class HRVariationManager:
-    """Manages smooth HR variation for multiple devices."""
+    """Manages smooth HR variation for multiple devices.
+
+    Per-device state is kept as parallel numpy arrays indexed by a slot
+    number, so each tick updates every enabled device in a few vector ops.
+    """
 
     def __init__(self):
-        self._devices: dict[str, HRDeviceState] = {}
+        self._id_to_slot: dict[str, int] = {}
+        self._slot_ids: list[str] = []
+        self._targets = np.empty(_INITIAL_CAPACITY, np.float32)
+        self._float_hr = np.empty(_INITIAL_CAPACITY, np.float32)
+        self._phase_idx = np.empty(_INITIAL_CAPACITY, np.int32)
+        self._enabled_mask = np.zeros(_INITIAL_CAPACITY, bool)
+        self._last_sent = np.empty(_INITIAL_CAPACITY, np.int16)
+        self._rng = np.random.default_rng()
         self._mqtt_manager = None
         self._device_registry = None
         self._ws_broadcast = None
+        self._ws_has_clients = None
+        self._ticker: asyncio.Task | None = None
 
-    def set_dependencies(self, mqtt_manager, device_registry, ws_broadcast=None):
+    def set_dependencies(self, mqtt_manager, device_registry, ws_broadcast=None, ws_has_clients=None):
         """Set required dependencies after initialization."""
         self._mqtt_manager = mqtt_manager
         self._device_registry = device_registry
         self._ws_broadcast = ws_broadcast
+        self._ws_has_clients = ws_has_clients
+
+    def _should_broadcast(self) -> bool:
+        """Whether a WebSocket broadcast would reach anyone."""
+        if not self._ws_broadcast:
+            return False
+        return self._ws_has_clients is None or self._ws_has_clients()
+
+    def _add_slot(self, device_id: str, target: int) -> int:
+        """Allocate state for a new device, growing the arrays if needed."""
+        slot = len(self._slot_ids)
+        if slot == len(self._targets):
+            capacity = slot * 2
+            self._targets = np.resize(self._targets, capacity)
+            self._float_hr = np.resize(self._float_hr, capacity)
+            self._phase_idx = np.resize(self._phase_idx, capacity)
+            self._last_sent = np.resize(self._last_sent, capacity)
+            enabled = np.zeros(capacity, bool)
+            enabled[:slot] = self._enabled_mask
+            self._enabled_mask = enabled
+
+        self._targets[slot] = target
+        self._float_hr[slot] = target
+        self._phase_idx[slot] = self._rng.integers(_SIN_LUT_SIZE)
+        self._enabled_mask[slot] = False
+        self._last_sent[slot] = _NOT_SENT
+        self._slot_ids.append(device_id)
+        self._id_to_slot[device_id] = slot
+        return slot
 
     def get_state(self, device_id: str) -> dict:
         """Get current HR variation state for a device."""
-        if device_id not in self._devices:
+        slot = self._id_to_slot.get(device_id)
+        if slot is None:
             return {"enabled": False, "target": 70, "current": 70}
 
-        state = self._devices[device_id]
         return {
-            "enabled": state.enabled,
-            "target": state.target,
-            "current": round(state.float_hr),
+            "enabled": bool(self._enabled_mask[slot]),
+            "target": int(self._targets[slot]),
+            "current": round(float(self._float_hr[slot])),
         }
 
     async def set_target(self, device_id: str, target: int):
         """Set HR target for a device."""
-        if device_id not in self._devices:
-            self._devices[device_id] = HRDeviceState(target=target, float_hr=float(target))
+        slot = self._id_to_slot.get(device_id)
+        if slot is None:
+            slot = self._add_slot(device_id, target)
         else:
-            self._devices[device_id].target = target
+            self._targets[slot] = target
 
         # If variation not enabled, send value directly
-        if not self._devices[device_id].enabled:
+        if not self._enabled_mask[slot]:
             await self._send_hr(device_id, target)
 
     async def enable(self, device_id: str, target: int | None = None):
         """Enable HR variation for a device."""
-        if device_id not in self._devices:
-            initial_target = target or 70
-            self._devices[device_id] = HRDeviceState(
-                target=initial_target,
-                float_hr=float(initial_target)
-            )
+        slot = self._id_to_slot.get(device_id)
+        if slot is None:
+            slot = self._add_slot(device_id, target or 70)
         elif target is not None:
-            self._devices[device_id].target = target
-
-        state = self._devices[device_id]
+            self._targets[slot] = target
 
-        if state.enabled and state.task and not state.task.done():
-            return  # Already running
+        if not self._enabled_mask[slot]:
+            self._enabled_mask[slot] = True
+            self._last_sent[slot] = _NOT_SENT
 
-        state.enabled = True
-        state.task = asyncio.create_task(self._variation_loop(device_id))
+        # One shared ticker drives every enabled device
+        if self._ticker is None or self._ticker.done():
+            self._ticker = asyncio.create_task(self._ticker_loop())
 
     async def disable(self, device_id: str):
         """Disable HR variation for a device."""
-        if device_id not in self._devices:
+        slot = self._id_to_slot.get(device_id)
+        if slot is None:
             return
 
-        state = self._devices[device_id]
-        state.enabled = False
-
-        if state.task and not state.task.done():
-            state.task.cancel()
-            try:
-                await state.task
-            except asyncio.CancelledError:
-                pass
-            state.task = None
+        # The ticker skips disabled devices and exits once none are left
+        self._enabled_mask[slot] = False
 
     async def stop_all(self):
         """Stop all variation tasks (for shutdown)."""
-        for device_id in list(self._devices.keys()):
-            await self.disable(device_id)
-
-    async def _variation_loop(self, device_id: str):
-        """Run smooth HR variation for a device."""
-        state = self._devices[device_id]
-        last_sent = None
+        self._enabled_mask[:] = False
 
+        if self._ticker and not self._ticker.done():
+            self._ticker.cancel()
+            try:
+                await self._ticker
+            except asyncio.CancelledError:
+                pass
+        self._ticker = None
+
+    def _advance(self) -> list[tuple[str, int]] | None:
+        """Advance every enabled device by one tick.
+
+        Returns (device_id, hr) pairs whose rounded HR changed, or None
+        when no device has variation enabled.
+        """
+        slots = np.flatnonzero(self._enabled_mask[:len(self._slot_ids)])
+        if not slots.size:
+            return None
+
+        # Advance phase (completes cycle in ~16 seconds)
+        phase = (self._phase_idx[slots] + _PHASE_STEP) & (_SIN_LUT_SIZE - 1)
+        self._phase_idx[slots] = phase
+
+        # Smooth sinusoidal base variation (±2 BPM) plus a small random walk
+        random_walk = (self._rng.random(slots.size, np.float32) - 0.5) * 0.6
+        ideal_hr = self._targets[slots] + _SIN_LUT[phase] + random_walk
+
+        # Smooth transition toward ideal
+        # Far from target: move max 1 BPM per tick (2 BPM/sec at 0.5s ticks)
+        # Close to target: use proportional smoothing
+        float_hr = self._float_hr[slots]
+        delta = ideal_hr - float_hr
+        float_hr += np.where(np.abs(delta) > 3, np.sign(delta), delta * 0.2)
+        self._float_hr[slots] = float_hr
+
+        # Round for transmission, only send if changed
+        current_hr = np.round(np.clip(float_hr, 30, 220)).astype(np.int16)
+        changed = current_hr != self._last_sent[slots]
+        self._last_sent[slots] = current_hr
+
+        slot_ids = self._slot_ids
+        return [
+            (slot_ids[slot], hr)
+            for slot, hr in zip(slots[changed].tolist(), current_hr[changed].tolist())
+        ]
+
+    async def _ticker_loop(self):
+        """Run smooth HR variation for all enabled devices on a shared 0.5s tick."""
         try:
-            while state.enabled:
-                # Advance phase (completes cycle in ~30 seconds)
-                state.phase += 0.2
-
-                # Smooth sinusoidal base variation (±2 BPM)
-                sine_variation = math.sin(state.phase) * 2
-
-                # Small random walk component
-                random_walk = (random.random() - 0.5) * 0.6
-
-                # Calculate ideal HR
-                ideal_hr = state.target + sine_variation + random_walk
-
-                # Smooth transition toward ideal
-                # Use rate-limited step when far from target for smooth ramp
-                distance = abs(ideal_hr - state.float_hr)
-                if distance > 3:
-                    # Far from target: move max 1 BPM per tick (2 BPM/sec at 0.5s ticks)
-                    step = 1.0 if ideal_hr > state.float_hr else -1.0
-                    state.float_hr += step
-                else:
-                    # Close to target: use proportional smoothing
-                    state.float_hr += (ideal_hr - state.float_hr) * 0.2
-
-                # Round for transmission
-                current_hr = round(max(30, min(220, state.float_hr)))
-
-                # Only send if changed
-                if current_hr != last_sent:
-                    last_sent = current_hr
-                    await self._send_hr(device_id, current_hr)
+            while True:
+                to_send = self._advance()
+                if to_send is None:
+                    break
+
+                if to_send:
+                    # One device failing to publish must not stop the shared ticker
+                    results = await asyncio.gather(
+                        *(self._send_hr(d, hr, broadcast=False) for d, hr in to_send),
+                        return_exceptions=True,
+                    )
+                    for (d, _), result in zip(to_send, results):
+                        if isinstance(result, Exception):
+                            print(f"Warning: Failed to send HR for {d}: {result}")
+                    # Coalesce this tick's updates into a single WebSocket message
+                    if self._should_broadcast():
+                        updates = [[d, hr] for (d, hr), ok in zip(to_send, results) if ok is True]
+                        if updates:
+                            await self._ws_broadcast({
+                                "type": "hr_batch",
+                                "updates": updates
+                            })
 
                 await asyncio.sleep(0.5)
 
         except asyncio.CancelledError:
             pass
 
-    async def _send_hr(self, device_id: str, hr: int):
-        """Send HR value to device via MQTT and update registry."""
+    async def _send_hr(self, device_id: str, hr: int, broadcast: bool = True) -> bool:
+        """Send HR value to device via MQTT and update registry.
+
+        Returns False if the device isn't a heart rate monitor (nothing sent).
+        With broadcast=False the caller is responsible for notifying WebSocket clients.
+        """
         # Only send HR to devices configured as heart_rate type
         if self._device_registry:
             device = self._device_registry.get_device(device_id)
             if device and device.get("type") != "heart_rate":
                 # Device is not a heart rate monitor, disable variation
-                if device_id in self._devices and self._devices[device_id].enabled:
-                    self._devices[device_id].enabled = False
-                return
+                slot = self._id_to_slot.get(device_id)
+                if slot is not None:
+                    self._enabled_mask[slot] = False
+                return False
 
         if self._mqtt_manager and self._mqtt_manager.is_connected:
             await self._mqtt_manager.publish(
-                f"ble-sim/{device_id}/set",
+                self._mqtt_manager.topics(device_id)["set"],
                 {"heart_rate": hr}
             )
 
@@ -158,12 +231,13 @@ class HRVariationManager:
             self._device_registry.update_device(device_id, {"values": {"heart_rate": hr}})
 
         # Broadcast to WebSocket clients
-        if self._ws_broadcast:
+        if broadcast and self._should_broadcast():
             await self._ws_broadcast({
                 "type": "hr_update",
                 "device_id": device_id,
                 "heart_rate": hr
             })
+        return True
 
 
 # Global instance
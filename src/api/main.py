@@ -1,6 +1,5 @@
 """FastAPI application for BLE device simulator control."""
 
-import json
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 
@@ -10,56 +9,33 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 import os
+import orjson
 
 from .routes import router
 from .mqtt_client import mqtt_manager
 from .device_registry import device_registry
 from .hr_variation import hr_variation_manager
+from .connection_manager import ws_manager
 
 
-class ConnectionManager:
-    """Manages WebSocket connections for broadcasting device updates."""
-
-    def __init__(self):
-        self.active_connections: list[WebSocket] = []
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-
-    def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-
-    async def broadcast(self, message: dict):
-        """Send message to all connected clients."""
-        disconnected = []
-        for connection in self.active_connections:
-            try:
-                await connection.send_json(message)
-            except Exception:
-                disconnected.append(connection)
-        # Clean up disconnected clients
-        for conn in disconnected:
-            self.disconnect(conn)
-
-
-ws_manager = ConnectionManager()
+# Drop per-device MQTT topic cache entries when devices are deleted
+device_registry.add_remove_listener(mqtt_manager.forget_device)
 
 
 # Register MQTT message handlers
 @mqtt_manager.on_message("ble-sim/+/status")
-async def handle_device_status(topic: str, payload: str):
+async def handle_device_status(topic: str, payload: bytes):
     """Handle device status updates from ESP32s."""
     parts = topic.split("/")
     if len(parts) >= 2:
         device_id = parts[1]
+        # Skip if device was recently deleted (prevents stale MQTT messages from re-registering)
+        if device_registry.is_deleted(device_id):
+            print(f"Ignoring status from deleted device: {device_id}")
+            return
         try:
-            data = json.loads(payload)
-            # Skip if device was recently deleted (prevents stale MQTT messages from re-registering)
-            if not device_registry.register_device(device_id):
-                print(f"Ignoring status from deleted device: {device_id}")
-                return
+            data = orjson.loads(payload)
+            device_registry.register_device(device_id)
             update_data = {
                 "online": data.get("online", True),
                 "type": data.get("type"),
@@ -68,38 +44,41 @@ async def handle_device_status(topic: str, payload: str):
                 "firmware_version": data.get("firmware_version"),
                 "bt_mac": data.get("bt_mac"),
             }
-            device_registry.update_device(device_id, update_data)
+            device = device_registry.update_device(device_id, update_data)
             print(f"Device {device_id} status updated: {data}")
             # Broadcast to WebSocket clients
-            await ws_manager.broadcast({
-                "type": "device_update",
-                "device_id": device_id,
-                "data": device_registry.get_device(device_id)
-            })
-        except json.JSONDecodeError:
+            if ws_manager.has_clients():
+                await ws_manager.broadcast({
+                    "type": "device_update",
+                    "device_id": device_id,
+                    "data": device
+                })
+        except orjson.JSONDecodeError:
             pass
 
 
 @mqtt_manager.on_message("ble-sim/+/values")
-async def handle_device_values(topic: str, payload: str):
+async def handle_device_values(topic: str, payload: bytes):
     """Handle device value updates from ESP32s."""
     parts = topic.split("/")
     if len(parts) >= 2:
         device_id = parts[1]
+        # Skip if device was recently deleted, before paying for the JSON parse
+        if device_registry.is_deleted(device_id):
+            print(f"Ignoring values from deleted device: {device_id}")
+            return
         try:
-            data = json.loads(payload)
-            # Skip if device was recently deleted
-            if not device_registry.update_device(device_id, {"values": data}):
-                print(f"Ignoring values from deleted device: {device_id}")
-                return
+            data = orjson.loads(payload)
+            device = device_registry.update_device(device_id, {"values": data})
             print(f"Device {device_id} values updated: {data}")
             # Broadcast to WebSocket clients
-            await ws_manager.broadcast({
-                "type": "device_update",
-                "device_id": device_id,
-                "data": device_registry.get_device(device_id)
-            })
-        except json.JSONDecodeError:
+            if ws_manager.has_clients():
+                await ws_manager.broadcast({
+                    "type": "device_update",
+                    "device_id": device_id,
+                    "data": device
+                })
+        except orjson.JSONDecodeError:
             pass
 
 
@@ -111,7 +90,8 @@ async def lifespan(app: FastAPI):
     hr_variation_manager.set_dependencies(
         mqtt_manager=mqtt_manager,
         device_registry=device_registry,
-        ws_broadcast=ws_manager.broadcast
+        ws_broadcast=ws_manager.broadcast,
+        ws_has_clients=ws_manager.has_clients
     )
     yield
     await hr_variation_manager.stop_all()
@@ -165,14 +145,12 @@ async def health():
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     """WebSocket endpoint for real-time device updates."""
-    await ws_manager.connect(websocket)
+    # Current device state is queued as the first message on connect
+    await ws_manager.connect(websocket, lambda: {
+        "type": "initial_state",
+        "devices": device_registry.get_all_devices()
+    })
     try:
-        # Send current device state on connect
-        devices = device_registry.get_all_devices()
-        await websocket.send_json({
-            "type": "initial_state",
-            "devices": devices
-        })
         # Keep connection alive and handle any incoming messages
         while True:
             # Wait for messages (or connection close)
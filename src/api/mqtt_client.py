@@ -1,10 +1,20 @@
 """MQTT client manager for communicating with ESP32 devices."""
 
 import asyncio
-import json
 import os
 from typing import Callable
 import aiomqtt
+import orjson
+
+
+# Trie key under which a node stores the handlers for patterns ending there
+_HANDLERS = None
+
+# Max concrete topics whose matched handlers are remembered
+_DISPATCH_CACHE_SIZE = 4096
+
+# Max device_ids whose topic strings are remembered
+_TOPIC_CACHE_SIZE = 4096
 
 
 class MQTTManager:
@@ -13,8 +23,30 @@ class MQTTManager:
     def __init__(self):
         self.client: aiomqtt.Client | None = None
         self._connected = False
-        self._message_handlers: dict[str, list[Callable]] = {}
+        # Segment trie of subscribed patterns: literal / "+" / "#" -> child node
+        self._trie: dict = {}
+        # Concrete topic -> matching handlers, rebuilt lazily after registrations
+        self._dispatch: dict[str, tuple[Callable, ...]] = {}
         self._listen_task: asyncio.Task | None = None
+        # Per-device topic strings, built once per device_id
+        self._topic_cache: dict[str, dict[str, str]] = {}
+
+    def topics(self, device_id: str) -> dict[str, str]:
+        """Get the MQTT topics for a device, keyed by suffix (set, config, disconnect, status, values)."""
+        topics = self._topic_cache.get(device_id)
+        if topics is None:
+            # Callers may pass arbitrary (unknown) IDs, so keep the cache bounded
+            if len(self._topic_cache) >= _TOPIC_CACHE_SIZE:
+                self._topic_cache.clear()
+            topics = self._topic_cache[device_id] = {
+                suffix: f"ble-sim/{device_id}/{suffix}"
+                for suffix in ("set", "config", "disconnect", "status", "values")
+            }
+        return topics
+
+    def forget_device(self, device_id: str):
+        """Drop cached topics for a removed device."""
+        self._topic_cache.pop(device_id, None)
 
     @property
     def is_connected(self) -> bool:
@@ -60,55 +92,67 @@ class MQTTManager:
         try:
             async for message in self.client.messages:
                 topic = str(message.topic)
-                payload = message.payload.decode()
-
-                # Notify handlers
-                for pattern, handlers in self._message_handlers.items():
-                    if self._topic_matches(pattern, topic):
-                        for handler in handlers:
-                            try:
-                                await handler(topic, payload)
-                            except Exception as e:
-                                print(f"Handler error: {e}")
+                handlers = self._dispatch.get(topic)
+                if handlers is None:
+                    handlers = self._handlers_for(topic)
+
+                # Notify handlers - payload stays raw bytes, handlers parse it.
+                # One try frame per message: a failing handler skips the rest.
+                try:
+                    for handler in handlers:
+                        await handler(topic, message.payload)
+                except Exception as e:
+                    print(f"Handler error: {e}")
         except asyncio.CancelledError:
             pass
         except aiomqtt.MqttError:
             # Expected during shutdown when client disconnects
             pass
 
-    def _topic_matches(self, pattern: str, topic: str) -> bool:
-        """Check if topic matches pattern (supports + and # wildcards)."""
-        pattern_parts = pattern.split("/")
-        topic_parts = topic.split("/")
-
-        if len(pattern_parts) != len(topic_parts):
-            if "#" not in pattern_parts:
-                return False
-
-        for p, t in zip(pattern_parts, topic_parts):
-            if p == "#":
-                return True
-            if p != "+" and p != t:
-                return False
-
-        return True
+    def _handlers_for(self, topic: str) -> tuple[Callable, ...]:
+        """Resolve and remember the handlers for a concrete topic."""
+        found: list[Callable] = []
+        self._collect_handlers(self._trie, topic.split("/"), 0, found)
+        if len(self._dispatch) >= _DISPATCH_CACHE_SIZE:
+            self._dispatch.clear()
+        handlers = self._dispatch[topic] = tuple(found)
+        return handlers
+
+    def _collect_handlers(self, node: dict, parts: list[str], i: int, out: list[Callable]):
+        """Walk the pattern trie, gathering handlers whose pattern matches parts[i:]."""
+        multi = node.get("#")
+        if multi is not None:
+            out.extend(multi[_HANDLERS])
+        if i == len(parts):
+            out.extend(node.get(_HANDLERS, ()))
+            return
+        child = node.get(parts[i])
+        if child is not None:
+            self._collect_handlers(child, parts, i + 1, out)
+        child = node.get("+")
+        if child is not None:
+            self._collect_handlers(child, parts, i + 1, out)
 
     def on_message(self, topic_pattern: str):
         """Decorator to register a message handler."""
         def decorator(func: Callable):
-            if topic_pattern not in self._message_handlers:
-                self._message_handlers[topic_pattern] = []
-            self._message_handlers[topic_pattern].append(func)
+            node = self._trie
+            for part in topic_pattern.split("/"):
+                node = node.setdefault(part, {})
+                if part == "#":
+                    break  # "#" must be last and matches everything below
+            node.setdefault(_HANDLERS, []).append(func)
+            self._dispatch.clear()
             return func
         return decorator
 
-    async def publish(self, topic: str, payload: dict | str, retain: bool = False):
+    async def publish(self, topic: str, payload: dict | str | bytes, retain: bool = False):
         """Publish a message to MQTT."""
         if not self._connected or not self.client:
             raise RuntimeError("MQTT not connected")
 
         if isinstance(payload, dict):
-            payload = json.dumps(payload)
+            payload = orjson.dumps(payload)
 
         await self.client.publish(topic, payload, retain=retain)
 
@@ -121,14 +165,14 @@ class MQTTManager:
     async def configure_device(self, device_id: str, device_type: str):
         """Send configuration command to a device."""
         await self.publish(
-            f"ble-sim/{device_id}/config",
+            self.topics(device_id)["config"],
             {"type": device_type}
         )
 
-    async def set_device_values(self, device_id: str, values: dict):
-        """Send value update to a device."""
+    async def set_device_values(self, device_id: str, values: dict | str | bytes):
+        """Send value update to a device (dict, or already-encoded JSON)."""
         await self.publish(
-            f"ble-sim/{device_id}/set",
+            self.topics(device_id)["set"],
             values
         )
 
@@ -145,7 +189,7 @@ class MQTTManager:
             payload["duration_ms"] = duration_ms
         if teardown:
             payload["teardown"] = True
-        await self.publish(f"ble-sim/{device_id}/disconnect", payload)
+        await self.publish(self.topics(device_id)["disconnect"], payload)
 
 
 # Global MQTT manager instance
@@ -1,48 +1,107 @@
 """API routes for device control."""
 
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel, Field
+import asyncio
+from typing import Annotated
+
+import msgspec
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from pydantic import BaseModel
 
 from .mqtt_client import mqtt_manager
 from .device_registry import device_registry
 from .hr_variation import hr_variation_manager
+from .connection_manager import ws_manager
 
 router = APIRouter()
 
 
+def msgspec_body(struct_type: type, allow_empty: bool = False):
+    """FastAPI dependency that decodes and validates the JSON body with msgspec.
+
+    With allow_empty, a missing body yields struct_type() (all defaults).
+    """
+    async def decode(request: Request):
+        body = await request.body()
+        if not body and allow_empty:
+            return struct_type()
+        try:
+            # Non-strict mode keeps pydantic's lax coercions ("70", 70.0, 1 -> True)
+            return msgspec.json.decode(body, type=struct_type, strict=False)
+        except msgspec.DecodeError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+    return decode
+
+
+def msgspec_openapi(struct_type: type, required: bool = True) -> dict:
+    """openapi_extra documenting a msgspec_body route's JSON body.
+
+    Depends(msgspec_body(...)) hides the body from FastAPI, so the schema is
+    generated from the same Struct that validates it.
+    """
+    # Structs here are flat, so the component schema can be inlined as is
+    (_,), components = msgspec.json.schema_components((struct_type,))
+    return {
+        "requestBody": {
+            "required": required,
+            "content": {"application/json": {"schema": components[struct_type.__name__]}},
+        }
+    }
+
+
 class DeviceConfig(BaseModel):
     """Device configuration request."""
     device_type: str  # "heart_rate", "treadmill", "bike"
 
 
-class DeviceValues(BaseModel):
+class DeviceValues(msgspec.Struct, omit_defaults=True):
     """Device values update request."""
-    heart_rate: int | None = Field(None, ge=30, le=220)  # Valid BPM range
-    speed: float | None = Field(None, ge=0, le=50)  # km/h, max 50 km/h
-    incline: float | None = Field(None, ge=-10, le=40)  # percent
-    cadence: int | None = Field(None, ge=0, le=300)  # rpm
-    power: int | None = Field(None, ge=0, le=2000)  # watts
-    battery: int | None = Field(None, ge=0, le=100)  # battery percentage
-    distance: int | None = Field(None, ge=0)  # distance in meters
-
-
-class HRVariationConfig(BaseModel):
+    heart_rate: Annotated[int, msgspec.Meta(ge=30, le=220)] | None = None  # Valid BPM range
+    speed: Annotated[float, msgspec.Meta(ge=0, le=50)] | None = None  # km/h, max 50 km/h
+    incline: Annotated[float, msgspec.Meta(ge=-10, le=40)] | None = None  # percent
+    cadence: Annotated[int, msgspec.Meta(ge=0, le=300)] | None = None  # rpm
+    power: Annotated[int, msgspec.Meta(ge=0, le=2000)] | None = None  # watts
+    battery: Annotated[int, msgspec.Meta(ge=0, le=100)] | None = None  # battery percentage
+    distance: Annotated[int, msgspec.Meta(ge=0)] | None = None  # distance in meters
+
+    def to_dict_fast(self) -> dict:
+        """Set fields as a dict, dropping unset (None) values."""
+        values = {}
+        for name in self.__struct_fields__:
+            value = getattr(self, name)
+            if value is not None:
+                values[name] = value
+        return values
+
+
+class HRVariationConfig(msgspec.Struct):
     """HR variation configuration."""
     enabled: bool
-    target: int | None = Field(None, ge=30, le=220)
+    target: Annotated[int, msgspec.Meta(ge=30, le=220)] | None = None
 
 
-class BLEDisconnectRequest(BaseModel):
+class BLEDisconnectRequest(msgspec.Struct):
     """BLE disconnect request."""
-    duration_ms: int = Field(0, ge=0, le=60000)  # Max 60 seconds
-    teardown: bool = Field(False, description="Full BLE stack teardown (device disappears from scans)")
+    duration_ms: Annotated[int, msgspec.Meta(ge=0, le=60000)] = 0  # Max 60 seconds
+    teardown: bool = False  # Full BLE stack teardown (device disappears from scans)
 
 
 @router.get("/devices")
-async def list_devices():
-    """List all connected devices."""
+async def list_devices(
+    device_type: str | None = Query(None, alias="type"),
+    online: bool | None = None,
+):
+    """List all connected devices, optionally filtered by type or online status."""
+    if device_type is not None:
+        devices = list(device_registry.get_devices_by_type(device_type))
+    elif online:
+        devices = list(device_registry.get_online_devices())
+    else:
+        devices = device_registry.get_all_devices()
+    # The online index already answers online=true on its own
+    if online is not None and (device_type is not None or not online):
+        devices = [d for d in devices if bool(d.get("online")) == online]
     return {
-        "devices": device_registry.get_all_devices()
+        "devices": devices
     }
 
 
@@ -65,27 +124,28 @@ async def delete_device(device_id: str):
     # Stop any HR variation for this device
     await hr_variation_manager.disable(device_id)
 
-    # Clear retained MQTT messages so device doesn't reappear on restart
-    try:
-        await mqtt_manager.clear_retained(f"ble-sim/{device_id}/status")
-        await mqtt_manager.clear_retained(f"ble-sim/{device_id}/values")
-    except Exception as e:
-        # Log the error but continue with deletion
-        print(f"Warning: Failed to clear MQTT retained messages for {device_id}: {e}")
+    # Clear retained MQTT messages so device doesn't reappear on restart, and
+    # broadcast deletion so WebSocket clients remove the device card - all concurrently
+    topics = mqtt_manager.topics(device_id)
+    retained = (topics["status"], topics["values"])
+    results = await asyncio.gather(
+        *(mqtt_manager.clear_retained(topic) for topic in retained),
+        ws_manager.broadcast({
+            "type": "device_deleted",
+            "device_id": device_id
+        }),
+        return_exceptions=True,
+    )
+    for topic, result in zip(retained, results):
+        if isinstance(result, Exception):
+            # Log the error but continue with deletion
+            print(f"Warning: Failed to clear MQTT retained message {topic}: {result}")
+    if isinstance(results[-1], Exception):
+        print(f"Warning: Failed to broadcast device deletion: {results[-1]}")
 
     # Remove from registry (also marks as deleted to block re-registration)
     device_registry.remove_device(device_id)
 
-    # Broadcast deletion to all WebSocket clients so they remove the device card
-    try:
-        from .main import ws_manager
-        await ws_manager.broadcast({
-            "type": "device_deleted",
-            "device_id": device_id
-        })
-    except Exception as e:
-        print(f"Warning: Failed to broadcast device deletion: {e}")
-
     return {"status": "ok", "device_id": device_id, "message": "Device removed"}
 
 
@@ -103,14 +163,16 @@ async def configure_device(device_id: str, config: DeviceConfig):
     return {"status": "ok", "device_id": device_id, "type": config.device_type}
 
 
-@router.post("/devices/{device_id}/values")
-async def set_device_values(device_id: str, values: DeviceValues):
+@router.post("/devices/{device_id}/values", openapi_extra=msgspec_openapi(DeviceValues))
+async def set_device_values(device_id: str, values: DeviceValues = Depends(msgspec_body(DeviceValues))):
     """Update a device's simulated values."""
     if not mqtt_manager.is_connected:
         raise HTTPException(status_code=503, detail="MQTT not connected")
 
-    values_dict = values.model_dump(exclude_none=True)
-    await mqtt_manager.set_device_values(device_id, values_dict)
+    # msgspec writes the MQTT payload straight to JSON (None fields omitted);
+    # the dict is only for local state
+    await mqtt_manager.set_device_values(device_id, msgspec.json.encode(values))
+    values_dict = values.to_dict_fast()
 
     # Update local registry
     device_registry.update_device(device_id, {"values": values_dict})
@@ -118,8 +180,11 @@ async def set_device_values(device_id: str, values: DeviceValues):
     return {"status": "ok", "device_id": device_id, "values": values_dict}
 
 
-@router.post("/devices/{device_id}/disconnect")
-async def disconnect_ble(device_id: str, request: BLEDisconnectRequest = BLEDisconnectRequest()):
+@router.post("/devices/{device_id}/disconnect", openapi_extra=msgspec_openapi(BLEDisconnectRequest, required=False))
+async def disconnect_ble(
+    device_id: str,
+    request: BLEDisconnectRequest = Depends(msgspec_body(BLEDisconnectRequest, allow_empty=True)),
+):
     """Simulate a BLE disconnect.
 
     Args:
@@ -145,8 +210,8 @@ async def get_hr_variation(device_id: str):
     return hr_variation_manager.get_state(device_id)
 
 
-@router.post("/devices/{device_id}/hr-variation")
-async def set_hr_variation(device_id: str, config: HRVariationConfig):
+@router.post("/devices/{device_id}/hr-variation", openapi_extra=msgspec_openapi(HRVariationConfig))
+async def set_hr_variation(device_id: str, config: HRVariationConfig = Depends(msgspec_body(HRVariationConfig))):
     """Enable or disable HR variation for a device."""
     if config.enabled:
         await hr_variation_manager.enable(device_id, config.target)
@@ -163,13 +228,13 @@ async def set_hr_variation(device_id: str, config: HRVariationConfig):
     }
 
 
-class HRTargetRequest(BaseModel):
+class HRTargetRequest(msgspec.Struct):
     """HR target request."""
-    target: int = Field(ge=30, le=220)
+    target: Annotated[int, msgspec.Meta(ge=30, le=220)]
 
 
-@router.post("/devices/{device_id}/hr-target")
-async def set_hr_target(device_id: str, request: HRTargetRequest):
+@router.post("/devices/{device_id}/hr-target", openapi_extra=msgspec_openapi(HRTargetRequest))
+async def set_hr_target(device_id: str, request: HRTargetRequest = Depends(msgspec_body(HRTargetRequest))):
     """Set HR target (works with or without variation enabled)."""
     await hr_variation_manager.set_target(device_id, request.target)
     return {
@@ -1,9 +1,13 @@
 """MCP Server for BLE device simulator control."""
 
 import asyncio
-import json
 import os
+import sys
+from functools import lru_cache
+from typing import Literal, get_args
 import aiomqtt
+import orjson
+from pydantic import BaseModel, Field
 from mcp.server import Server
 from mcp.server.stdio import stdio_server
 from mcp.types import Tool, TextContent
@@ -12,6 +16,17 @@ from mcp.types import Tool, TextContent
 # Device state (shared with API via MQTT)
 devices: dict[str, dict] = {}
 
+# Raw values payloads per device in arrival order, decoded lazily when state
+# is read. Merged in order so an undecodable payload can't erase a good one.
+_pending_values: dict[str, list[bytes]] = {}
+
+# Pending payloads kept per device before they are merged eagerly
+_MAX_PENDING_VALUES = 32
+
+# Devices known only from a values payload that hasn't been decoded yet.
+# Dropped again if that payload turns out to be invalid.
+_unconfirmed: set[str] = set()
+
 # MQTT client for this server
 mqtt_client: aiomqtt.Client | None = None
 
@@ -24,333 +39,419 @@ def get_mqtt_port() -> int:
     return int(os.getenv("MQTT_PORT", "1883"))
 
 
+def _get_values(device_id: str) -> dict:
+    """Get a known device's values, merging in any pending raw payloads first.
+
+    Undecodable payloads are skipped. A device created only by undecodable
+    payloads is removed, as if those messages had never arrived.
+    """
+    values = devices[device_id].setdefault("values", {})
+    pending = _pending_values.pop(device_id, None)
+    if pending is not None:
+        for raw in pending:
+            try:
+                payload = orjson.loads(raw)
+            except orjson.JSONDecodeError:
+                continue
+            if isinstance(payload, dict):
+                values.update(payload)
+                _unconfirmed.discard(device_id)
+        if device_id in _unconfirmed:
+            _unconfirmed.discard(device_id)
+            del devices[device_id]
+    return values
+
+
+def _flush_pending_values():
+    """Decode every pending values payload (before serializing device state)."""
+    for device_id in list(_pending_values):
+        _get_values(device_id)
+
+
+@lru_cache(maxsize=4096)
+def _topic(device_id: str, suffix: str) -> str:
+    """MQTT topic for a device, cached so repeat publishes reuse the same string."""
+    return f"ble-sim/{device_id}/{suffix}"
+
+
 # Create MCP server
 server = Server("ble-simulator")
 
 
-@server.list_tools()
-async def list_tools() -> list[Tool]:
-    """List available MCP tools."""
-    return [
-        Tool(
-            name="list_devices",
-            description="List all connected ESP32 BLE simulator devices",
-            inputSchema={
-                "type": "object",
-                "properties": {},
-                "required": [],
-            },
-        ),
-        Tool(
-            name="configure_device",
-            description="Configure an ESP32 to simulate a specific BLE device type",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "device_id": {
-                        "type": "string",
-                        "description": "The ESP32 device ID",
-                    },
-                    "device_type": {
-                        "type": "string",
-                        "enum": ["heart_rate", "treadmill", "bike"],
-                        "description": "Type of BLE device to simulate",
-                    },
+# Tool definitions are static, so build them once at import
+_TOOLS: list[Tool] = [
+    Tool(
+        name="list_devices",
+        description="List all connected ESP32 BLE simulator devices",
+        inputSchema={
+            "type": "object",
+            "properties": {},
+            "required": [],
+        },
+    ),
+    Tool(
+        name="configure_device",
+        description="Configure an ESP32 to simulate a specific BLE device type",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "device_id": {
+                    "type": "string",
+                    "description": "The ESP32 device ID",
+                },
+                "device_type": {
+                    "type": "string",
+                    "enum": ["heart_rate", "treadmill", "bike"],
+                    "description": "Type of BLE device to simulate",
                 },
-                "required": ["device_id", "device_type"],
             },
-        ),
-        Tool(
-            name="set_heart_rate",
-            description="Set the simulated heart rate value for a device configured as a heart rate monitor",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "device_id": {
-                        "type": "string",
-                        "description": "The ESP32 device ID",
-                    },
-                    "bpm": {
-                        "type": "integer",
-                        "minimum": 30,
-                        "maximum": 220,
-                        "description": "Heart rate in beats per minute",
-                    },
+            "required": ["device_id", "device_type"],
+        },
+    ),
+    Tool(
+        name="set_heart_rate",
+        description="Set the simulated heart rate value for a device configured as a heart rate monitor",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "device_id": {
+                    "type": "string",
+                    "description": "The ESP32 device ID",
+                },
+                "bpm": {
+                    "type": "integer",
+                    "minimum": 30,
+                    "maximum": 220,
+                    "description": "Heart rate in beats per minute",
                 },
-                "required": ["device_id", "bpm"],
             },
-        ),
-        Tool(
-            name="set_treadmill_values",
-            description="Set simulated values for a device configured as a treadmill",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "device_id": {
-                        "type": "string",
-                        "description": "The ESP32 device ID",
-                    },
-                    "speed": {
-                        "type": "number",
-                        "minimum": 0,
-                        "maximum": 25,
-                        "description": "Speed in km/h",
-                    },
-                    "incline": {
-                        "type": "number",
-                        "minimum": -5,
-                        "maximum": 30,
-                        "description": "Incline percentage",
-                    },
+            "required": ["device_id", "bpm"],
+        },
+    ),
+    Tool(
+        name="set_treadmill_values",
+        description="Set simulated values for a device configured as a treadmill",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "device_id": {
+                    "type": "string",
+                    "description": "The ESP32 device ID",
+                },
+                "speed": {
+                    "type": "number",
+                    "minimum": 0,
+                    "maximum": 25,
+                    "description": "Speed in km/h",
+                },
+                "incline": {
+                    "type": "number",
+                    "minimum": -5,
+                    "maximum": 30,
+                    "description": "Incline percentage",
                 },
-                "required": ["device_id"],
             },
-        ),
-        Tool(
-            name="set_bike_values",
-            description="Set simulated values for a device configured as a bike/cycling trainer",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "device_id": {
-                        "type": "string",
-                        "description": "The ESP32 device ID",
-                    },
-                    "power": {
-                        "type": "integer",
-                        "minimum": 0,
-                        "maximum": 2000,
-                        "description": "Power in watts",
-                    },
-                    "cadence": {
-                        "type": "integer",
-                        "minimum": 0,
-                        "maximum": 200,
-                        "description": "Cadence in RPM",
-                    },
-                    "speed": {
-                        "type": "number",
-                        "minimum": 0,
-                        "maximum": 80,
-                        "description": "Speed in km/h",
-                    },
+            "required": ["device_id"],
+        },
+    ),
+    Tool(
+        name="set_bike_values",
+        description="Set simulated values for a device configured as a bike/cycling trainer",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "device_id": {
+                    "type": "string",
+                    "description": "The ESP32 device ID",
+                },
+                "power": {
+                    "type": "integer",
+                    "minimum": 0,
+                    "maximum": 2000,
+                    "description": "Power in watts",
+                },
+                "cadence": {
+                    "type": "integer",
+                    "minimum": 0,
+                    "maximum": 200,
+                    "description": "Cadence in RPM",
+                },
+                "speed": {
+                    "type": "number",
+                    "minimum": 0,
+                    "maximum": 80,
+                    "description": "Speed in km/h",
                 },
-                "required": ["device_id"],
             },
-        ),
-        Tool(
-            name="get_device_status",
-            description="Get the current status and values of a specific device",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "device_id": {
-                        "type": "string",
-                        "description": "The ESP32 device ID",
-                    },
+            "required": ["device_id"],
+        },
+    ),
+    Tool(
+        name="get_device_status",
+        description="Get the current status and values of a specific device",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "device_id": {
+                    "type": "string",
+                    "description": "The ESP32 device ID",
                 },
-                "required": ["device_id"],
             },
-        ),
-        Tool(
-            name="simulate_ble_disconnect",
-            description="Simulate a BLE client disconnection to test reconnection behavior",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "device_id": {
-                        "type": "string",
-                        "description": "The ESP32 device ID",
-                    },
-                    "duration_ms": {
-                        "type": "integer",
-                        "minimum": 0,
-                        "maximum": 60000,
-                        "default": 0,
-                        "description": "How long to pause advertising after disconnect (0 = immediate resume)",
-                    },
-                    "teardown": {
-                        "type": "boolean",
-                        "default": False,
-                        "description": "Full BLE stack teardown - device completely disappears from scans",
-                    },
+            "required": ["device_id"],
+        },
+    ),
+    Tool(
+        name="simulate_ble_disconnect",
+        description="Simulate a BLE client disconnection to test reconnection behavior",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "device_id": {
+                    "type": "string",
+                    "description": "The ESP32 device ID",
+                },
+                "duration_ms": {
+                    "type": "integer",
+                    "minimum": 0,
+                    "maximum": 60000,
+                    "default": 0,
+                    "description": "How long to pause advertising after disconnect (0 = immediate resume)",
+                },
+                "teardown": {
+                    "type": "boolean",
+                    "default": False,
+                    "description": "Full BLE stack teardown - device completely disappears from scans",
                 },
-                "required": ["device_id"],
             },
-        ),
-    ]
+            "required": ["device_id"],
+        },
+    ),
+]
 
 
-@server.call_tool()
-async def call_tool(name: str, arguments: dict) -> list[TextContent]:
-    """Handle tool calls."""
-    global mqtt_client
+@server.list_tools()
+async def list_tools() -> list[Tool]:
+    """List available MCP tools."""
+    return _TOOLS
 
-    # Ensure MQTT is connected
-    if mqtt_client is None:
-        try:
-            mqtt_client = aiomqtt.Client(
-                hostname=get_mqtt_host(),
-                port=get_mqtt_port()
-            )
-            await mqtt_client.__aenter__()
-        except Exception as e:
-            return [TextContent(
-                type="text",
-                text=f"Failed to connect to MQTT broker: {e}"
-            )]
 
-    try:
-        if name == "list_devices":
-            return [TextContent(
-                type="text",
-                text=json.dumps({
-                    "devices": list(devices.values()),
-                    "count": len(devices)
-                }, indent=2)
-            )]
-
-        elif name == "configure_device":
-            device_id = arguments["device_id"]
-            device_type = arguments["device_type"]
-
-            await mqtt_client.publish(
-                f"ble-sim/{device_id}/config",
-                json.dumps({"type": device_type})
-            )
+# Tool argument models - validated once per call, mirroring each inputSchema
+class ListDevicesArgs(BaseModel):
+    pass
 
-            # Update local state
-            if device_id not in devices:
-                devices[device_id] = {"id": device_id}
-            devices[device_id]["type"] = device_type
-            devices[device_id]["values"] = {}
-
-            return [TextContent(
-                type="text",
-                text=f"Configured {device_id} as {device_type}"
-            )]
-
-        elif name == "set_heart_rate":
-            device_id = arguments["device_id"]
-            bpm = arguments["bpm"]
-
-            # Validate BPM range
-            if not (30 <= bpm <= 220):
-                return [TextContent(
-                    type="text",
-                    text=f"Error: BPM must be between 30 and 220, got {bpm}"
-                )]
-
-            await mqtt_client.publish(
-                f"ble-sim/{device_id}/set",
-                json.dumps({"heart_rate": bpm})
-            )
 
-            if device_id in devices:
-                devices[device_id].setdefault("values", {})["heart_rate"] = bpm
-
-            return [TextContent(
-                type="text",
-                text=f"Set heart rate to {bpm} BPM on {device_id}"
-            )]
-
-        elif name == "set_treadmill_values":
-            device_id = arguments["device_id"]
-            values = {}
-            if "speed" in arguments:
-                values["speed"] = arguments["speed"]
-            if "incline" in arguments:
-                values["incline"] = arguments["incline"]
-
-            await mqtt_client.publish(
-                f"ble-sim/{device_id}/set",
-                json.dumps(values)
-            )
+class DeviceArgs(BaseModel):
+    device_id: str
 
-            if device_id in devices:
-                devices[device_id].setdefault("values", {}).update(values)
-
-            return [TextContent(
-                type="text",
-                text=f"Set treadmill values on {device_id}: {values}"
-            )]
-
-        elif name == "set_bike_values":
-            device_id = arguments["device_id"]
-            values = {}
-            if "power" in arguments:
-                values["power"] = arguments["power"]
-            if "cadence" in arguments:
-                values["cadence"] = arguments["cadence"]
-            if "speed" in arguments:
-                values["speed"] = arguments["speed"]
-
-            await mqtt_client.publish(
-                f"ble-sim/{device_id}/set",
-                json.dumps(values)
-            )
 
-            if device_id in devices:
-                devices[device_id].setdefault("values", {}).update(values)
-
-            return [TextContent(
-                type="text",
-                text=f"Set bike values on {device_id}: {values}"
-            )]
-
-        elif name == "get_device_status":
-            device_id = arguments["device_id"]
-            device = devices.get(device_id)
-
-            if device:
-                return [TextContent(
-                    type="text",
-                    text=json.dumps(device, indent=2)
-                )]
-            else:
-                return [TextContent(
-                    type="text",
-                    text=f"Device {device_id} not found"
-                )]
-
-        elif name == "simulate_ble_disconnect":
-            device_id = arguments["device_id"]
-            duration_ms = arguments.get("duration_ms", 0)
-            teardown = arguments.get("teardown", False)
-
-            payload = {}
-            if duration_ms > 0:
-                payload["duration_ms"] = duration_ms
-            if teardown:
-                payload["teardown"] = True
-
-            await mqtt_client.publish(
-                f"ble-sim/{device_id}/disconnect",
-                json.dumps(payload)
-            )
+DeviceType = Literal["heart_rate", "treadmill", "bike"]
+
+
+class ConfigureDeviceArgs(DeviceArgs):
+    device_type: DeviceType
+
+
+class SetHeartRateArgs(DeviceArgs):
+    bpm: int = Field(ge=30, le=220)
+
+
+class SetTreadmillValuesArgs(DeviceArgs):
+    speed: float | None = Field(None, ge=0, le=25)
+    incline: float | None = Field(None, ge=-5, le=30)
+
+
+class SetBikeValuesArgs(DeviceArgs):
+    power: int | None = Field(None, ge=0, le=2000)
+    cadence: int | None = Field(None, ge=0, le=200)
+    speed: float | None = Field(None, ge=0, le=80)
+
+
+class SimulateBLEDisconnectArgs(DeviceArgs):
+    duration_ms: int = Field(0, ge=0, le=60000)
+    teardown: bool = False
+
+
+# Fixed-shape MQTT payloads, skipping the JSON encoder (values are validated above)
+_HR_TMPL = b'{"heart_rate":%d}'
+_TYPE_PAYLOADS = {t: orjson.dumps({"type": t}) for t in get_args(DeviceType)}
+
+# Shared encoders - MQTT payloads go out as bytes, tool text as indented str
+_DUMP = orjson.dumps
+_PRETTY = orjson.OPT_INDENT_2
+
+
+async def _handle_list_devices(client: aiomqtt.Client, args: ListDevicesArgs) -> list[TextContent]:
+    _flush_pending_values()
+    return [TextContent(
+        type="text",
+        text=_DUMP({
+            "devices": list(devices.values()),
+            "count": len(devices)
+        }, option=_PRETTY).decode()
+    )]
+
+
+async def _handle_configure_device(client: aiomqtt.Client, args: ConfigureDeviceArgs) -> list[TextContent]:
+    device_id = args.device_id
+    device_type = args.device_type
+
+    await client.publish(
+        _topic(device_id, "config"),
+        _TYPE_PAYLOADS[device_type]
+    )
+
+    # Update local state
+    if device_id not in devices:
+        devices[device_id] = {"id": device_id}
+    devices[device_id]["type"] = device_type
+    devices[device_id]["values"] = {}
+    _pending_values.pop(device_id, None)
+    _unconfirmed.discard(device_id)
+
+    return [TextContent(
+        type="text",
+        text=f"Configured {device_id} as {device_type}"
+    )]
+
+
+async def _handle_set_heart_rate(client: aiomqtt.Client, args: SetHeartRateArgs) -> list[TextContent]:
+    device_id = args.device_id
+    bpm = args.bpm
+
+    await client.publish(
+        _topic(device_id, "set"),
+        _HR_TMPL % bpm
+    )
+
+    if device_id in devices:
+        _get_values(device_id)["heart_rate"] = bpm
+
+    return [TextContent(
+        type="text",
+        text=f"Set heart rate to {bpm} BPM on {device_id}"
+    )]
+
 
-            if teardown:
-                return [TextContent(
-                    type="text",
-                    text=f"BLE stack teardown on {device_id}, will reinit in {duration_ms if duration_ms > 0 else 3000}ms"
-                )]
-            elif duration_ms > 0:
-                return [TextContent(
-                    type="text",
-                    text=f"Disconnected BLE on {device_id}, advertising paused for {duration_ms}ms"
-                )]
-            else:
-                return [TextContent(
-                    type="text",
-                    text=f"Disconnected BLE on {device_id}, advertising resumed immediately"
-                )]
-
-        else:
-            return [TextContent(
-                type="text",
-                text=f"Unknown tool: {name}"
-            )]
+async def _handle_set_treadmill_values(client: aiomqtt.Client, args: SetTreadmillValuesArgs) -> list[TextContent]:
+    device_id = args.device_id
+    values = args.model_dump(exclude={"device_id"}, exclude_unset=True)
 
+    await client.publish(
+        _topic(device_id, "set"),
+        _DUMP(values)
+    )
+
+    if device_id in devices:
+        _get_values(device_id).update(values)
+
+    return [TextContent(
+        type="text",
+        text=f"Set treadmill values on {device_id}: {values}"
+    )]
+
+
+async def _handle_set_bike_values(client: aiomqtt.Client, args: SetBikeValuesArgs) -> list[TextContent]:
+    device_id = args.device_id
+    values = args.model_dump(exclude={"device_id"}, exclude_unset=True)
+
+    await client.publish(
+        _topic(device_id, "set"),
+        _DUMP(values)
+    )
+
+    if device_id in devices:
+        _get_values(device_id).update(values)
+
+    return [TextContent(
+        type="text",
+        text=f"Set bike values on {device_id}: {values}"
+    )]
+
+
+async def _handle_get_device_status(client: aiomqtt.Client, args: DeviceArgs) -> list[TextContent]:
+    device_id = args.device_id
+    if device_id in _pending_values:
+        _get_values(device_id)
+    device = devices.get(device_id)
+
+    if device:
+        return [TextContent(
+            type="text",
+            text=_DUMP(device, option=_PRETTY).decode()
+        )]
+    else:
+        return [TextContent(
+            type="text",
+            text=f"Device {device_id} not found"
+        )]
+
+
+async def _handle_simulate_ble_disconnect(client: aiomqtt.Client, args: SimulateBLEDisconnectArgs) -> list[TextContent]:
+    device_id = args.device_id
+    duration_ms = args.duration_ms
+    teardown = args.teardown
+
+    payload = {}
+    if duration_ms > 0:
+        payload["duration_ms"] = duration_ms
+    if teardown:
+        payload["teardown"] = True
+
+    await client.publish(
+        _topic(device_id, "disconnect"),
+        _DUMP(payload)
+    )
+
+    if teardown:
+        return [TextContent(
+            type="text",
+            text=f"BLE stack teardown on {device_id}, will reinit in {duration_ms if duration_ms > 0 else 3000}ms"
+        )]
+    elif duration_ms > 0:
+        return [TextContent(
+            type="text",
+            text=f"Disconnected BLE on {device_id}, advertising paused for {duration_ms}ms"
+        )]
+    else:
+        return [TextContent(
+            type="text",
+            text=f"Disconnected BLE on {device_id}, advertising resumed immediately"
+        )]
+
+
+# Tool name -> (handler, argument model), so call_tool dispatches with a single lookup
+_HANDLERS = {
+    "list_devices": (_handle_list_devices, ListDevicesArgs),
+    "configure_device": (_handle_configure_device, ConfigureDeviceArgs),
+    "set_heart_rate": (_handle_set_heart_rate, SetHeartRateArgs),
+    "set_treadmill_values": (_handle_set_treadmill_values, SetTreadmillValuesArgs),
+    "set_bike_values": (_handle_set_bike_values, SetBikeValuesArgs),
+    "get_device_status": (_handle_get_device_status, DeviceArgs),
+    "simulate_ble_disconnect": (_handle_simulate_ble_disconnect, SimulateBLEDisconnectArgs),
+}
+
+
+@server.call_tool()
+async def call_tool(name: str, arguments: dict) -> list[TextContent]:
+    """Handle tool calls."""
+    # Shared client is (re)connected in the background by run_mqtt()
+    if mqtt_client is None:
+        return [TextContent(
+            type="text",
+            text="Not connected to MQTT broker"
+        )]
+
+    entry = _HANDLERS.get(name)
+    if entry is None:
+        return [TextContent(
+            type="text",
+            text=f"Unknown tool: {name}"
+        )]
+    handler, args_model = entry
+
+    try:
+        args = args_model.model_validate(arguments or {})
+        return await handler(mqtt_client, args)
     except Exception as e:
         return [TextContent(
             type="text",
@@ -358,45 +459,103 @@ async def call_tool(name: str, arguments: dict) -> list[TextContent]:
         )]
 
 
-async def handle_mqtt_messages():
-    """Background task to handle incoming MQTT status messages."""
-    global mqtt_client
+_TOPIC_PREFIX = "ble-sim/"
+
+
+def _apply_status(device_id: str, raw: bytes):
+    payload = orjson.loads(raw)
+    if not isinstance(payload, dict):
+        return
+    if device_id not in devices:
+        devices[device_id] = {"id": device_id}
+    devices[device_id]["online"] = payload.get("online", True)
+    devices[device_id]["type"] = payload.get("type")
+    _unconfirmed.discard(device_id)
+
 
+def _apply_values(device_id: str, raw: bytes):
+    # Keep the bytes; only decoded if an MCP tool reads this device's values
+    if len(_pending_values.get(device_id, ())) >= _MAX_PENDING_VALUES:
+        _get_values(device_id)
+    if device_id not in devices:
+        devices[device_id] = {"id": device_id}
+        _unconfirmed.add(device_id)
+    _pending_values.setdefault(device_id, []).append(raw)
+
+
+# Inbound message type (last topic level) -> how it updates local device state
+_MESSAGE_HANDLERS = {
+    "status": _apply_status,
+    "values": _apply_values,
+}
+
+
+async def handle_mqtt_messages(client: aiomqtt.Client):
+    """Background task to handle incoming MQTT status messages.
+
+    A bad message is skipped; only a connection error ends the session.
+    """
     try:
-        host = get_mqtt_host()
-        port = get_mqtt_port()
-
-        async with aiomqtt.Client(hostname=host, port=port) as client:
-            await client.subscribe("ble-sim/+/status")
-            await client.subscribe("ble-sim/+/values")
-
-            async for message in client.messages:
-                topic_parts = str(message.topic).split("/")
-                if len(topic_parts) >= 3:
-                    device_id = topic_parts[1]
-                    msg_type = topic_parts[2]
-
-                    try:
-                        payload = json.loads(message.payload.decode())
-
-                        if device_id not in devices:
-                            devices[device_id] = {"id": device_id}
-
-                        if msg_type == "status":
-                            devices[device_id]["online"] = payload.get("online", True)
-                            devices[device_id]["type"] = payload.get("type")
-                        elif msg_type == "values":
-                            devices[device_id].setdefault("values", {}).update(payload)
-                    except json.JSONDecodeError:
-                        pass
-    except Exception as e:
-        print(f"MQTT listener error: {e}", flush=True)
+        async for message in client.messages:
+            topic = str(message.topic)
+            if not topic.startswith(_TOPIC_PREFIX):
+                continue
+            device_id, _, msg_type = topic[len(_TOPIC_PREFIX):].partition("/")
+            # IDs repeat for every message; interned keys hit the identity fast path
+            device_id = sys.intern(device_id)
+            apply = _MESSAGE_HANDLERS.get(msg_type)
+            # Empty payloads are retained-message clears for deleted devices
+            if apply is None or not message.payload:
+                continue
+
+            try:
+                apply(device_id, message.payload)
+            except orjson.JSONDecodeError:
+                pass
+            except Exception as e:
+                print(f"Ignoring {msg_type} message for {device_id}: {e}", file=sys.stderr, flush=True)
+    except aiomqtt.MqttError as e:
+        print(f"MQTT listener error: {e}", file=sys.stderr, flush=True)
+
+
+# Reconnect backoff bounds (seconds) for the shared MQTT client
+_MQTT_RETRY_MIN = 0.5
+_MQTT_RETRY_MAX = 10.0
+
+
+async def run_mqtt():
+    """Keep the shared MQTT client connected and feed its messages to the listener.
+
+    Retries with exponential backoff, so tools start working as soon as the
+    broker is reachable (e.g. when mosquitto is still starting up).
+    """
+    global mqtt_client
+
+    delay = _MQTT_RETRY_MIN
+    while True:
+        try:
+            async with aiomqtt.Client(
+                hostname=get_mqtt_host(),
+                port=get_mqtt_port()
+            ) as client:
+                await client.subscribe("ble-sim/+/status")
+                await client.subscribe("ble-sim/+/values")
+                mqtt_client = client
+                delay = _MQTT_RETRY_MIN
+                await handle_mqtt_messages(client)
+        except Exception as e:
+            print(f"MQTT connection failed: {e}", file=sys.stderr, flush=True)
+        finally:
+            mqtt_client = None
+
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, _MQTT_RETRY_MAX)
 
 
 async def main():
     """Run the MCP server."""
-    # Start MQTT listener in background
-    mqtt_task = asyncio.create_task(handle_mqtt_messages())
+    # One MQTT connection serves both tool publishes and the status listener
+    mqtt_task = asyncio.create_task(run_mqtt())
 
     try:
         # Run MCP server on stdio
@@ -414,5 +573,16 @@ async def main():
             pass
 
 
+def run():
+    """Run main() on uvloop when available, else the default asyncio loop."""
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(main())
+        return
+    with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+        runner.run(main())
+
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    run()